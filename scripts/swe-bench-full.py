@@ -1,169 +1,329 @@
 #!/usr/bin/env python3
 """Run meta-agent-v3 on SWE-bench Lite (300 instances).
-Usage: python3 scripts/swe-bench-full.py [--start N] [--limit N] [--instance ID]
+Usage: python3 scripts/swe-bench-full.py [--start N] [--limit N] [--instance ID] [--timeout S]
+       [--workers N] [--max-agents N] [--starts-per-minute N]
 """
-import json, subprocess, os, sys, time, argparse
+import subprocess, os, sys, time, argparse, tempfile, shutil, mmap, asyncio, collections
 from pathlib import Path
 
+from swe_bench_common import (GIT, GIT_DIFF, MAX_PATCH_SIZE, json_line, kill_session,
+                              load_swe_bench, run, work_dir)
+
 COGNOS = os.path.expanduser("~/clawd/neocognos/cognos-lang/target/release/cognos")
 COGNOS_DIR = os.path.expanduser("~/clawd/neocognos/cognos-lang")
 AGENT = os.path.join(COGNOS_DIR, "examples/meta-agent-v3.cog")
 RESULTS_DIR = os.path.expanduser("~/clawd/neocognos/cognos-lang/swe-results")
-REPOS_DIR = "/tmp/swe-repos"
 
-def load_dataset():
-    """Load SWE-bench Lite dataset."""
-    from datasets import load_dataset
-    ds = load_dataset('princeton-nlp/SWE-bench_Lite', split='test')
-    return list(ds)
+# Mirrors plus every in-flight worktree share this, so ask for more room than a single checkout
+REPOS_DIR = work_dir("swe-repos", min_free=8 << 30)
+MIRRORS_DIR = os.path.join(REPOS_DIR, ".mirrors")
+
+# Abort stalled fetches instead of hanging until the subprocess timeout
+GIT_ENV = dict(os.environ, GIT_HTTP_LOW_SPEED_LIMIT="1000", GIT_HTTP_LOW_SPEED_TIME="30")
+
+# Bounds concurrent agent runs (each one drives Anthropic calls); created in run_all()
+AGENT_SLOTS = None
+
+# Sliding-window limit on agent starts per minute (0 disables); set from --starts-per-minute
+STARTS_PER_MINUTE = 30
+_recent_starts = collections.deque()
+_START_LOCK = None
+
+# One lock per GitHub repo: serializes clone/fetch/worktree ops on the shared mirror
+_REPO_LOCKS = {}
+# Mirrors already refreshed (and pruned of dead worktrees) by this process
+_FETCHED = set()
+
+def log(msg):
+    print(msg, flush=True)
+
+async def wait_for_start_slot():
+    """Block until fewer than STARTS_PER_MINUTE agents were started in the last 60s, then claim a slot.
+
+    Only sleeps when starts are actually bunched up; slow instances never wait.
+    """
+    if not STARTS_PER_MINUTE:
+        return
+    async with _START_LOCK:
+        while True:
+            now = time.monotonic()
+            while _recent_starts and now - _recent_starts[0] >= 60:
+                _recent_starts.popleft()
+            if len(_recent_starts) < STARTS_PER_MINUTE:
+                break
+            await asyncio.sleep(60 - (now - _recent_starts[0]))
+        _recent_starts.append(time.monotonic())
+
+def make_result(iid, status, patch_size=0, mode="unknown", elapsed=0, exit_code=None, error=None):
+    """Build a results.jsonl record; every record has the same keys in the same order."""
+    return {"id": iid, "status": status, "patch_size": patch_size, "mode": mode,
+            "time": elapsed, "exit_code": exit_code, "error": error}
+
+def repo_lock(repo):
+    """Return the lock guarding the shared mirror of `repo`."""
+    return _REPO_LOCKS.setdefault(repo, asyncio.Lock())
+
+def mirror_path(repo):
+    """Bare mirror shared by every instance of `repo`."""
+    return os.path.join(MIRRORS_DIR, f"{repo.replace('/', '__')}.git")
+
+def worktree_path(iid):
+    """Checkout used by instance `iid`."""
+    return os.path.join(REPOS_DIR, iid.replace('/', '__'))
 
-def setup_repo(instance):
-    """Clone and checkout the correct commit for an instance."""
+async def setup_repo(instance):
+    """Check out the instance's base commit in its own worktree of a shared per-repo mirror.
+
+    Every worktree of a repo shares the mirror's object store, so pack data is
+    downloaded once per repo rather than once per instance.
+    """
     repo = instance['repo']
     commit = instance['base_commit']
     iid = instance['instance_id']
-    repo_path = os.path.join(REPOS_DIR, iid.replace('/', '__'))
-    
-    if not os.path.exists(repo_path):
-        print(f"  Cloning {repo}...", flush=True)
-        r = subprocess.run(
-            ["git", "clone", "--depth", "200", f"https://github.com/{repo}.git", repo_path],
-            capture_output=True, text=True, timeout=180
-        )
-        if r.returncode != 0:
-            # Try full clone for repos that need deeper history
-            subprocess.run(
-                ["git", "clone", f"https://github.com/{repo}.git", repo_path],
-                capture_output=True, text=True, timeout=300
-            )
+    slug = repo.replace('/', '__')
+    mirror = mirror_path(repo)
+    repo_path = worktree_path(iid)
     
-    # Checkout the base commit
-    subprocess.run(["git", "checkout", commit], cwd=repo_path, capture_output=True, text=True)
-    subprocess.run(["git", "checkout", "--", "."], cwd=repo_path, capture_output=True, text=True)
-    subprocess.run(["git", "clean", "-fd"], cwd=repo_path, capture_output=True, text=True)
+    async with repo_lock(repo):
+        if not os.path.exists(mirror):
+            log(f"  [{iid}] Mirroring {repo}...")
+            # Blobless bare clone: commits/trees only, blobs fetched on checkout, so any base_commit resolves
+            code, _, err = await run(
+                GIT + ["clone", "--bare", "--filter=blob:none", f"https://github.com/{repo}.git", mirror],
+                timeout=300, env=GIT_ENV
+            )
+            if code != 0:
+                shutil.rmtree(mirror, ignore_errors=True)
+                raise RuntimeError(f"clone failed: {err.strip()[:200]}")
+            # Track branches only; a true --mirror would also pull GitHub's refs/pull/*
+            await run(GIT + ["config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"], cwd=mirror, capture=False)
+            _FETCHED.add(slug)
+        elif slug not in _FETCHED:
+            # Forget worktrees whose directories a killed earlier run left behind or lost
+            await run(GIT + ["worktree", "prune"], cwd=mirror, capture=False)
+            await run(GIT + ["fetch", "--filter=blob:none", "origin"], cwd=mirror, timeout=300, env=GIT_ENV, capture=False)
+            _FETCHED.add(slug)
+        
+        if not os.path.exists(repo_path):
+            # Commits not reachable from any branch need an explicit fetch
+            code, _, _ = await run(GIT + ["cat-file", "-e", f"{commit}^{{commit}}"], cwd=mirror, capture=False)
+            if code != 0:
+                await run(GIT + ["fetch", "--filter=blob:none", "origin", commit],
+                          cwd=mirror, timeout=300, env=GIT_ENV, capture=False)
+            code, _, err = await run(
+                GIT + ["worktree", "add", "--detach", repo_path, commit],
+                cwd=mirror, timeout=300, env=GIT_ENV
+            )
+            if code != 0:
+                raise RuntimeError(f"worktree add failed: {err.strip()[:200]}")
+        else:
+            # Stale worktree from a killed earlier run: detach HEAD at the base commit, discarding
+            # its tracked edits (may fetch blobs into the shared mirror, hence under the lock),
+            # then drop untracked and ignored leftovers
+            await run(GIT + ["-c", "advice.detachedHead=false", "switch", "--discard-changes", "--detach", commit],
+                      cwd=repo_path, env=GIT_ENV, capture=False)
+            await run(GIT + ["clean", "-xfdq"], cwd=repo_path, capture=False)
     
     return repo_path
 
-def run_instance(instance, timeout=300):
-    """Run the meta-agent on a single instance."""
-    iid = instance['instance_id']
-    problem = instance['problem_statement']
-    
-    # Setup repo
+async def remove_worktree(repo, repo_path):
+    """Delete an instance's worktree; on tmpfs a whole sweep's checkouts would otherwise stay in RAM."""
+    mirror = mirror_path(repo)
+    if not os.path.isdir(mirror):
+        shutil.rmtree(repo_path, ignore_errors=True)
+        return
+    async with repo_lock(repo):
+        code, _, _ = await run(GIT + ["worktree", "remove", "--force", repo_path], cwd=mirror, capture=False)
+        if code != 0:
+            shutil.rmtree(repo_path, ignore_errors=True)
+            await run(GIT + ["worktree", "prune"], cwd=mirror, capture=False)
+
+def detect_mode(log_path):
+    """Classify a v3 run from its log. The fallback always follows Phase 1, so it takes precedence."""
+    with open(log_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "unknown"
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(b"Falling back to agent") >= 0:
+                return "v3-fallback"
+            if mm.find(b"Phase 1:") >= 0:
+                return "v3-scout"
+    return "unknown"
+
+async def run_instance(instance, timeout=300):
+    """Run the meta-agent on a single instance in a fresh worktree, removed again afterwards."""
     try:
-        repo_path = setup_repo(instance)
+        repo_path = await setup_repo(instance)
     except Exception as e:
-        return {"id": iid, "status": "CLONE_FAILED", "error": str(e)}
+        # A timed-out worktree add can leave a half-written checkout behind
+        stale = worktree_path(instance['instance_id'])
+        if os.path.exists(stale):
+            await remove_worktree(instance['repo'], stale)
+        # repr: a TimeoutError has an empty str()
+        return make_result(instance['instance_id'], "CLONE_FAILED", error=repr(e))
+    
+    try:
+        return await run_agent(instance, repo_path, timeout)
+    finally:
+        await remove_worktree(instance['repo'], repo_path)
+
+async def run_agent(instance, repo_path, timeout):
+    """Run the meta-agent against a checked-out repo, then collect its patch and log."""
+    iid = instance['instance_id']
+    problem = instance['problem_statement']
     
-    # Write issue and repo path
-    with open("/tmp/cognos-issue.txt", "w") as f:
+    # Per-instance scratch dir for the issue/repo handoff and the agent's own temp files,
+    # so concurrent workers don't clobber each other
+    scratch_dir = tempfile.mkdtemp(prefix="cognos-swe-")
+    issue_file = os.path.join(scratch_dir, "issue.txt")
+    repo_file = os.path.join(scratch_dir, "repo.txt")
+    with open(issue_file, "w") as f:
         f.write(problem)
-    with open("/tmp/cognos-repo.txt", "w") as f:
+    with open(repo_file, "w") as f:
         f.write(repo_path)
     
     # Run meta-agent
     env = os.environ.copy()
     env.pop('ANTHROPIC_API_KEY', None)
+    env["COGNOS_ISSUE_FILE"] = issue_file
+    env["COGNOS_REPO_FILE"] = repo_file
+    env["COGNOS_SCRATCH_DIR"] = scratch_dir
+    
+    # Stream agent output straight to disk; renamed into place once the run is complete
+    log_file = os.path.join(RESULTS_DIR, "logs", f"{iid}.log")
+    partial_log = log_file + ".part"
     
-    start_time = time.time()
     try:
-        r = subprocess.run(
-            [COGNOS, "run", "--allow-shell", AGENT],
-            capture_output=True, text=True, timeout=timeout,
-            cwd=COGNOS_DIR, env=env
-        )
-        output = r.stdout + r.stderr
-        exit_code = r.returncode
-    except subprocess.TimeoutExpired:
-        output = "TIMEOUT"
-        exit_code = -1
-    
-    elapsed = time.time() - start_time
+        async with AGENT_SLOTS:
+            await wait_for_start_slot()
+            with open(partial_log, "wb") as log_fh:
+                start_time = time.time()
+                proc = await asyncio.create_subprocess_exec(
+                    COGNOS, "run", "--allow-shell", AGENT,
+                    stdout=log_fh, stderr=subprocess.STDOUT,
+                    cwd=COGNOS_DIR, env=env, start_new_session=True
+                )
+                try:
+                    exit_code = await asyncio.wait_for(proc.wait(), timeout)
+                except asyncio.TimeoutError:
+                    await kill_session(proc)
+                    log_fh.write(b"\nTIMEOUT\n")
+                    exit_code = -1
+                finally:
+                    # The agent has its own session, so neither Ctrl-C nor a cancelled batch reaches it
+                    await kill_session(proc)
+            elapsed = time.time() - start_time
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
     
     # Check for patch
-    diff = subprocess.run(["git", "diff"], cwd=repo_path, capture_output=True, text=True)
-    patch = diff.stdout.strip()
+    _, patch, _ = await run(GIT_DIFF, cwd=repo_path)
+    patch = patch.strip()
+    patch_size = len(patch)
     
     # Extract mode from output
-    mode = "unknown"
-    for line in output.split("\n"):
-        if "Phase 1:" in line:
-            mode = "v3-scout"
-        elif "Falling back to agent" in line:
-            mode = "v3-fallback"
-    
-    result = {
-        "id": iid,
-        "status": "PATCH" if (patch and len(patch) > 10) else "NO_PATCH",
-        "patch_size": len(patch) if patch else 0,
-        "mode": mode,
-        "time": round(elapsed, 1),
-        "exit_code": exit_code,
-    }
+    mode = detect_mode(partial_log)
+    
+    if patch_size > MAX_PATCH_SIZE:
+        status = "PATCH_TOO_LARGE"
+        patch = ""
+    else:
+        status = "PATCH" if patch_size > 10 else "NO_PATCH"
+    
+    result = make_result(iid, status, patch_size=patch_size, mode=mode,
+                         elapsed=round(elapsed, 1), exit_code=exit_code)
     
     # Save patch
-    if patch and len(patch) > 10:
+    if status == "PATCH":
         patch_file = os.path.join(RESULTS_DIR, "patches", f"{iid}.patch")
-        os.makedirs(os.path.dirname(patch_file), exist_ok=True)
         with open(patch_file, "w") as f:
             f.write(patch)
     
-    # Save output
-    log_file = os.path.join(RESULTS_DIR, "logs", f"{iid}.log")
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    with open(log_file, "w") as f:
-        f.write(output)
+    # Publish the log last: its presence marks the instance as done
+    os.replace(partial_log, log_file)
     
     return result
 
+async def run_all(todo, args):
+    """Run the pending instances concurrently, appending each result as it completes."""
+    global AGENT_SLOTS, STARTS_PER_MINUTE, _START_LOCK
+    AGENT_SLOTS = asyncio.Semaphore(args.max_agents or args.workers)
+    STARTS_PER_MINUTE = args.starts_per_minute
+    _START_LOCK = asyncio.Lock()
+    # asyncio locks belong to the loop that first used them; start fresh for this loop
+    _REPO_LOCKS.clear()
+    workers = asyncio.Semaphore(args.workers)
+    
+    async def worker(instance):
+        async with workers:
+            try:
+                return await run_instance(instance, timeout=args.timeout)
+            except Exception as e:
+                return make_result(instance['instance_id'], "ERROR", error=repr(e))
+    
+    results = []
+    results_file = os.path.join(RESULTS_DIR, "results.jsonl")
+    
+    # Unbuffered binary: each record goes out in a single write
+    with open(results_file, "ab", buffering=0) as results_fh:
+        for i, pending in enumerate(asyncio.as_completed([worker(inst) for inst in todo])):
+            result = await pending
+            results.append(result)
+            
+            emoji = "✅" if result["status"] == "PATCH" else "❌"
+            log(f"[{i+1}/{len(todo)}] {result['id']}\n  {emoji} {result['status']} ({result['time']}s, {result['mode']})")
+            
+            # Append to results file
+            results_fh.write(json_line(result))
+    
+    return results
+
+def non_negative_int(value):
+    """argparse type for counts where 0 means "off"."""
+    n = int(value)
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0, got {n}")
+    return n
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--start", type=int, default=0)
     parser.add_argument("--limit", type=int, default=300)
     parser.add_argument("--instance", type=str, default=None)
     parser.add_argument("--timeout", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="instances to run concurrently")
+    parser.add_argument("--max-agents", type=int, default=None,
+                        help="cap on concurrent agent runs (default: --workers)")
+    parser.add_argument("--starts-per-minute", type=non_negative_int, default=STARTS_PER_MINUTE,
+                        help="rate limit on agent launches over a sliding 60s window (0: off)")
     args = parser.parse_args()
     
-    os.makedirs(RESULTS_DIR, exist_ok=True)
-    os.makedirs(REPOS_DIR, exist_ok=True)
+    # Output dirs are fixed, so create them once here rather than per instance
+    os.makedirs(os.path.join(RESULTS_DIR, "logs"), exist_ok=True)
+    os.makedirs(os.path.join(RESULTS_DIR, "patches"), exist_ok=True)
+    os.makedirs(MIRRORS_DIR, exist_ok=True)
     
     print("Loading SWE-bench Lite...", flush=True)
-    dataset = load_dataset()
-    print(f"Loaded {len(dataset)} instances", flush=True)
+    table = load_swe_bench()
+    print(f"Loaded {table.num_rows} instances", flush=True)
     
     if args.instance:
-        dataset = [d for d in dataset if d['instance_id'] == args.instance]
+        import pyarrow.compute as pc
+        dataset = table.filter(pc.equal(table['instance_id'], args.instance)).to_pylist()
         if not dataset:
             print(f"Instance {args.instance} not found")
             return
     else:
-        dataset = dataset[args.start:args.start + args.limit]
+        dataset = table.slice(args.start, args.limit).to_pylist()
     
-    results = []
-    results_file = os.path.join(RESULTS_DIR, "results.jsonl")
+    # Skip instances that already have a log (one directory listing, not a stat per instance)
+    done = {p.stem for p in Path(RESULTS_DIR, "logs").glob("*.log")}
+    todo = [d for d in dataset if d['instance_id'] not in done]
+    if len(todo) < len(dataset):
+        log(f"Skipping {len(dataset) - len(todo)} already-done instances")
     
-    for i, instance in enumerate(dataset):
-        iid = instance['instance_id']
-        print(f"\n{'='*60}", flush=True)
-        print(f"[{i+1}/{len(dataset)}] {iid}", flush=True)
-        
-        # Check if already done
-        if os.path.exists(os.path.join(RESULTS_DIR, "logs", f"{iid}.log")):
-            print("  Already done, skipping.", flush=True)
-            continue
-        
-        result = run_instance(instance, timeout=args.timeout)
-        results.append(result)
-        
-        emoji = "✅" if result["status"] == "PATCH" else "❌"
-        print(f"  {emoji} {result['status']} ({result['time']}s, {result['mode']})", flush=True)
-        
-        # Append to results file
-        with open(results_file, "a") as f:
-            f.write(json.dumps(result) + "\n")
-        
-        # Brief pause to avoid rate limits
-        time.sleep(2)
+    results = asyncio.run(run_all(todo, args))
     
     # Summary
     print(f"\n{'='*60}", flush=True)
@@ -1,15 +1,32 @@
 #!/usr/bin/env python3
 """Run Cognos coding agent on SWE-bench instances."""
-import json
+import asyncio
+import mmap
 import subprocess
 import sys
 import os
+import shutil
+import tarfile
 import tempfile
-from datasets import load_dataset
+import urllib.error
+import urllib.request
+import pyarrow.compute as pc
+
+from swe_bench_common import (GIT, GIT_DIFF, MAX_PATCH_SIZE, json_line, kill_session,
+                              load_swe_bench, run, work_dir)
 
 COGNOS = os.path.expanduser("~/clawd/neocognos/cognos-lang/target/release/cognos")
 COGNOS_DIR = os.path.expanduser("~/clawd/neocognos/cognos-lang")
 
+# Per-instance checkouts live only while their agent runs, so a little tmpfs goes a long way
+WORK_DIR = work_dir("swe-bench-run", min_free=2 << 30)
+# SQLite in-memory store: no file to create, fsync or delete per instance. It lives and dies
+# with the agent process, so nothing is shared between instances.
+MEMORY_DB = ":memory:"
+
+# Source snapshot at a commit; far fewer bytes than a clone since we never need history
+ARCHIVE_URL = "https://github.com/{repo}/archive/{commit}.tar.gz"
+
 AGENTS = {
     "coding": os.path.join(COGNOS_DIR, "examples/coding-agent-opus.cog"),
     "meta": os.path.join(COGNOS_DIR, "examples/meta-agent.cog"),
@@ -19,7 +36,80 @@ AGENTS = {
 }
 AGENT = AGENTS["coding"]  # default
 
-def run_instance(instance, timeout=600):
+def _parse_env_file(path):
+    """Yield (key, value) pairs from a KEY=VALUE .env file, skipping blanks and comments."""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                yield line.split("=", 1)
+
+# .env is constant for the whole run, so parse it once rather than per instance
+_ENV_FILE = os.path.join(COGNOS_DIR, ".env")
+_ENV_OVERRIDES = dict(_parse_env_file(_ENV_FILE)) if os.path.exists(_ENV_FILE) else {}
+
+def download_archive(repo, commit, dest):
+    """Stream the GitHub tarball of `repo` at `commit` into `dest`.
+    Returns False if GitHub has no archive for it (404).
+
+    GitHub builds archives with `git archive`, so the repo's export-ignore and
+    export-subst attributes apply: the tree can lack files or carry expanded
+    placeholders compared with a checkout of `commit`."""
+    url = ARCHIVE_URL.format(repo=repo, commit=commit)
+    req = urllib.request.Request(url, headers={"User-Agent": "cognos-swe-bench"})
+    try:
+        resp = urllib.request.urlopen(req, timeout=120)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return False
+        raise
+    with resp, tarfile.open(fileobj=resp, mode="r|gz") as tar:
+        for member in tar:
+            # Drop the "<name>-<commit>/" directory GitHub wraps everything in
+            _, _, name = member.name.partition("/")
+            if not name:
+                continue
+            member.name = name
+            # "data" raises on absolute or escaping paths, links out of dest and device files; a
+            # skipped member would leave a tree unlike base_commit, so let the caller fall back to git
+            tar.extract(member, dest, filter="data")
+    return True
+
+async def init_base_repo(repo_path):
+    """Commit an extracted snapshot so the agent (and we) can `git diff` against it.
+    Files matched by the repo's own .gitignore are force-added, or edits to them would drop out of the patch."""
+    git = GIT + ["-c", "user.name=cognos", "-c", "user.email=cognos@localhost", "-c", "commit.gpgsign=false"]
+    for cmd in (["init", "-q"], ["add", "-A", "-f"], ["commit", "-q", "-m", "base"]):
+        code, _, _ = await run(git + cmd, cwd=repo_path, capture=False)
+        if code != 0:
+            return False
+    return True
+
+PATCH_START = b"--- PATCH ---"
+PATCH_END = b"--- END PATCH ---"
+_WHITESPACE = b" \t\n\r\x0b\x0c"
+
+def extract_patch(path):
+    """Pull the text between the patch markers out of an agent log without loading it whole."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = mm.find(PATCH_START)
+            if start < 0:
+                return ""
+            start += len(PATCH_START)
+            end = mm.find(PATCH_END, start)
+            if end < 0:
+                end = len(mm)
+            # Trim whitespace by moving the offsets so the patch is copied out of the map once
+            while start < end and mm[start] in _WHITESPACE:
+                start += 1
+            while end > start and mm[end - 1] in _WHITESPACE:
+                end -= 1
+            return mm[start:end].decode("utf-8", errors="replace")
+
+async def run_instance(instance, timeout=600):
     """Run the coding agent on a single SWE-bench instance."""
     instance_id = instance["instance_id"]
     repo = instance["repo"]
@@ -33,84 +123,97 @@ def run_instance(instance, timeout=600):
     print(f"{'='*60}")
     
     # Clone repo at the right commit
-    with tempfile.TemporaryDirectory(prefix="swe-bench-") as tmpdir:
+    with tempfile.TemporaryDirectory(prefix="swe-bench-", dir=WORK_DIR) as tmpdir:
         repo_path = os.path.join(tmpdir, "repo")
         
-        # Clone
-        print(f"Cloning {repo}...")
-        result = subprocess.run(
-            ["git", "clone", "--depth", "100", f"https://github.com/{repo}.git", repo_path],
-            capture_output=True, text=True, timeout=120
-        )
-        if result.returncode != 0:
-            print(f"Clone failed: {result.stderr[:200]}")
-            return {"instance_id": instance_id, "model_name_or_path": "cognos-agent", "model_patch": ""}
+        # Download the source snapshot; fall back to git if GitHub can't serve it
+        print(f"Downloading {repo}@{base_commit[:12]}...")
+        try:
+            have_tree = await asyncio.to_thread(download_archive, repo, base_commit, repo_path)
+            have_tree = have_tree and await init_base_repo(repo_path)
+        except Exception as e:
+            print(f"Archive download failed: {e}")
+            have_tree = False
         
-        # Checkout base commit
-        subprocess.run(
-            ["git", "checkout", base_commit],
-            cwd=repo_path, capture_output=True, text=True
-        )
+        if not have_tree:
+            shutil.rmtree(repo_path, ignore_errors=True)
+            print(f"Cloning {repo}...")
+            try:
+                code, _, err = await run(
+                    GIT + ["clone", "--depth", "100", f"https://github.com/{repo}.git", repo_path],
+                    timeout=120
+                )
+            except asyncio.TimeoutError:
+                code, err = -1, "timeout"
+            if code != 0:
+                print(f"Clone failed: {err[:200]}")
+                return {"instance_id": instance_id, "model_name_or_path": "cognos-agent", "model_patch": ""}
+            
+            # Checkout base commit
+            await run(GIT + ["-c", "advice.detachedHead=false", "checkout", base_commit],
+                      cwd=repo_path, capture=False)
         
         # Run the Cognos agent
         print("Running Cognos agent...")
         env = os.environ.copy()
-        # Source .env file
-        env_file = os.path.join(COGNOS_DIR, ".env")
-        if os.path.exists(env_file):
-            with open(env_file) as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith("#") and "=" in line:
-                        key, val = line.split("=", 1)
-                        env[key] = val
+        env.update(_ENV_OVERRIDES)
         
-        # Write issue and repo path to files for the agent
-        with open("/tmp/cognos-issue.txt", "w") as f:
+        # Write issue and repo path to per-instance files for the agent
+        issue_file = os.path.join(tmpdir, "issue.txt")
+        repo_file = os.path.join(tmpdir, "repo.txt")
+        with open(issue_file, "w") as f:
             f.write(problem)
-        with open("/tmp/cognos-repo.txt", "w") as f:
+        with open(repo_file, "w") as f:
             f.write(repo_path)
+        env["COGNOS_ISSUE_FILE"] = issue_file
+        env["COGNOS_REPO_FILE"] = repo_file
+        # Agent scratch files (edit helpers, generated flows) stay private to this instance
+        scratch_dir = os.path.join(tmpdir, "scratch")
+        os.mkdir(scratch_dir)
+        env["COGNOS_SCRATCH_DIR"] = scratch_dir
         
-        try:
-            result = subprocess.run(
-                [COGNOS, "run", "--memory", "--allow-shell", "-vv",
-                 "--trace", f"/tmp/cognos-swe-trace-{instance_id}.jsonl",
-                 "--trace-level", "full",
-                 "--memory-db", f"/tmp/cognos-swe-{instance_id}.db",
-                 "--memory-ns", instance_id,
-                 AGENT],
-                input="",
-                capture_output=True, text=True,
-                timeout=timeout,
+        # Stream agent stdio to files instead of buffering it in memory
+        stdout_path = os.path.join(tmpdir, "stdout.log")
+        stderr_path = os.path.join(tmpdir, "stderr.log")
+        with open(stdout_path, "wb") as out_fh, open(stderr_path, "wb") as err_fh:
+            proc = await asyncio.create_subprocess_exec(
+                COGNOS, "run", "--memory", "--allow-shell", "-vv",
+                "--trace", f"/tmp/cognos-swe-trace-{instance_id}.jsonl",
+                "--trace-level", "full",
+                "--memory-db", MEMORY_DB,
+                "--memory-ns", instance_id,
+                AGENT,
+                stdin=subprocess.DEVNULL, stdout=out_fh, stderr=err_fh,
                 cwd=COGNOS_DIR,
-                env=env
+                env=env,
+                start_new_session=True
             )
-            output = result.stdout
-            stderr = result.stderr
-        except subprocess.TimeoutExpired:
-            print(f"TIMEOUT after {timeout}s")
-            output = ""
-            stderr = "timeout"
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                await kill_session(proc)
+                print(f"TIMEOUT after {timeout}s")
+                err_fh.write(b"timeout")
+            finally:
+                # The agent has its own session, so neither Ctrl-C nor a cancelled batch reaches it
+                await kill_session(proc)
+        
+        with open(stdout_path, encoding="utf-8", errors="replace") as f:
+            output = f.read(500)
+        with open(stderr_path, encoding="utf-8", errors="replace") as f:
+            stderr = f.read(500)
         
         # Extract diff from output
-        patch = ""
-        if "--- PATCH ---" in output:
-            start = output.index("--- PATCH ---") + len("--- PATCH ---")
-            end = output.index("--- END PATCH ---") if "--- END PATCH ---" in output else len(output)
-            patch = output[start:end].strip()
+        patch = extract_patch(stdout_path)
         
         # Also try getting diff directly from repo
         if not patch:
-            diff_result = subprocess.run(
-                ["git", "diff"], cwd=repo_path, capture_output=True, text=True
-            )
-            patch = diff_result.stdout.strip()
+            _, patch, _ = await run(GIT_DIFF, cwd=repo_path)
+            patch = patch.strip()
         
-        # Clean up memory db
-        try:
-            os.remove(f"/tmp/cognos-swe-{instance_id}.db")
-        except:
-            pass
+        if len(patch) > MAX_PATCH_SIZE:
+            print(f"PATCH_TOO_LARGE: {len(patch)} chars, dropping")
+            patch = ""
         
         if stderr:
             print(f"Agent stderr: {stderr[:500]}")
@@ -128,29 +231,57 @@ def run_instance(instance, timeout=600):
             "model_patch": patch
         }
 
-def estimate_difficulty(instance):
-    """Rough heuristic: shorter problem statements with clear error messages are easier."""
-    problem = instance["problem_statement"]
-    score = 0
+# RE2 alternations: one linear-time DFA scan per row instead of one pass per keyword
+ERROR_PATTERN = r"TypeError|AttributeError|ValueError"
+SIMPLE_REPO_PATTERN = r"^(?:psf/requests|pallets/flask)"
+
+def estimate_difficulty(table):
+    """Rough heuristic: shorter problem statements with clear error messages are easier.
+    Scores every row of the dataset table in one pass over its columns."""
+    problem = table["problem_statement"]
     # Short problems tend to be simpler
-    if len(problem) < 500:
-        score += 2
-    elif len(problem) < 1000:
-        score += 1
+    length = pc.utf8_length(problem)
+    score = pc.if_else(pc.less(length, 500), 2, pc.if_else(pc.less(length, 1000), 1, 0))
     # Clear error traces help
-    if "TypeError" in problem or "AttributeError" in problem or "ValueError" in problem:
-        score += 2
-    if "Traceback" in problem:
-        score += 1
+    has_error = pc.match_substring_regex(problem, ERROR_PATTERN)
+    score = pc.add(score, pc.if_else(has_error, 2, 0))
+    score = pc.add(score, pc.if_else(pc.match_substring(problem, "Traceback"), 1, 0))
     # Single-file repos are easier
-    repo = instance["repo"]
-    if repo.startswith("psf/requests") or repo.startswith("pallets/flask"):
-        score += 1
-    return score
+    repo = table["repo"]
+    simple_repo = pc.match_substring_regex(repo, SIMPLE_REPO_PATTERN)
+    score = pc.add(score, pc.if_else(simple_repo, 1, 0))
+    return score.to_pylist()
+
+async def run_all(instances, output_file, workers):
+    """Run instances concurrently (at most `workers` at once), appending predictions as they finish."""
+    slots = asyncio.Semaphore(workers)
+    
+    async def worker(instance):
+        async with slots:
+            try:
+                return await run_instance(instance)
+            except Exception as e:
+                # One bad instance must not abort the rest of the batch
+                print(f"ERROR on {instance['instance_id']}: {e!r}")
+                return {"instance_id": instance["instance_id"], "model_name_or_path": "cognos-agent", "model_patch": ""}
+    
+    predictions = []
+    # Unbuffered binary: each prediction goes out in a single write
+    with open(output_file, "ab", buffering=0) as out_fh:
+        for pending in asyncio.as_completed([worker(inst) for inst in instances]):
+            pred = await pending
+            predictions.append(pred)
+            
+            # Append to file incrementally
+            out_fh.write(json_line(pred))
+            
+            print(f"\nProgress: {len(predictions)}/{len(instances)}")
+    return predictions
 
 def main():
     # Load dataset
-    ds = load_dataset("princeton-nlp/SWE-bench_Lite", split="test")
+    table = load_swe_bench()
+    os.makedirs(WORK_DIR, exist_ok=True)
     
     # Parse args
     n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
@@ -160,9 +291,12 @@ def main():
     
     # Agent selection
     agent_name = "coding"
+    workers = 1
     for arg in sys.argv:
         if arg.startswith("--agent="):
             agent_name = arg.split("=", 1)[1]
+        elif arg.startswith("--workers="):
+            workers = int(arg.split("=", 1)[1])
     if agent_name in AGENTS:
         global AGENT
         AGENT = AGENTS[agent_name]
@@ -173,29 +307,20 @@ def main():
     
     if easy_first:
         # Sort by estimated difficulty (easiest first)
-        indices = sorted(range(len(ds)), key=lambda i: -estimate_difficulty(ds[i]))
+        scores = estimate_difficulty(table)
+        indices = sorted(range(table.num_rows), key=scores.__getitem__, reverse=True)
         print(f"Running {n} EASIEST instances (sorted by heuristic)")
     else:
-        indices = list(range(len(ds)))
         print(f"Running {n} instances starting from {start}")
     
     print(f"Output: {output_file}")
     
-    predictions = []
     if easy_first:
-        run_indices = indices[start:start + n]
+        instances = table.take(indices[start:start + n]).to_pylist()
     else:
-        run_indices = list(range(start, min(start + n, len(ds))))
+        instances = table.slice(start, n).to_pylist()
     
-    for i in run_indices:
-        pred = run_instance(ds[i])
-        predictions.append(pred)
-        
-        # Append to file incrementally
-        with open(output_file, "a") as f:
-            f.write(json.dumps(pred) + "\n")
-        
-        print(f"\nProgress: {len(predictions)}/{n}")
+    predictions = asyncio.run(run_all(instances, output_file, workers))
     
     # Summary
     patches = sum(1 for p in predictions if p["model_patch"])
@@ -0,0 +1,81 @@
+"""Helpers shared by the SWE-bench runner scripts (swe-bench-full.py, swe-bench-run.py)."""
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import signal
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+DATASET_CACHE = "/tmp/swe_bench_lite.parquet"
+
+# Git with durability traded for speed: these checkouts are disposable, so skip per-object fsync
+# and auto-gc, and use the v2 wire protocol and the many-files index settings
+GIT = ["git", "-c", "core.fsync=none", "-c", "core.fsyncMethod=batch", "-c", "gc.auto=0",
+       "-c", "protocol.version=2", "-c", "feature.manyFiles=true"]
+
+# Applyable patch only: no rename detection, no colour, binary hunks kept
+GIT_DIFF = GIT + ["-c", "diff.renames=false", "-c", "core.fsmonitor=false", "diff", "--no-color", "--binary"]
+MAX_PATCH_SIZE = 1 << 20  # the evaluator rejects anything this big anyway
+
+def work_dir(name, min_free):
+    """Prefer tmpfs (/dev/shm/<name>) for checkouts; fall back to /tmp/<name> when shm is missing
+    or has less than `min_free` bytes free. An existing dir on shm is kept even if it has since
+    eaten into the free space."""
+    shm = os.path.join("/dev/shm", name)
+    try:
+        if os.path.isdir(shm) or shutil.disk_usage("/dev/shm").free >= min_free:
+            return shm
+    except OSError:
+        pass
+    return os.path.join("/tmp", name)
+
+def json_line(obj):
+    """Encode `obj` as one JSONL line (bytes)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj) + "\n").encode()
+
+def load_swe_bench():
+    """Load SWE-bench Lite as an Arrow table, cached locally as Parquet after the first run."""
+    import pyarrow.parquet as pq
+    if not os.path.exists(DATASET_CACHE):
+        from datasets import load_dataset
+        ds = load_dataset("princeton-nlp/SWE-bench_Lite", split="test")
+        tmp = f"{DATASET_CACHE}.{os.getpid()}.tmp"
+        ds.to_parquet(tmp)
+        os.replace(tmp, DATASET_CACHE)
+    return pq.read_table(DATASET_CACHE)
+
+async def kill_session(proc):
+    """SIGKILL an agent started with start_new_session=True, and everything it spawned, if still running."""
+    if proc.returncode is None:
+        # It may exit and be reaped just as we get here
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(proc.pid, signal.SIGKILL)
+        await proc.wait()
+
+async def run(cmd, cwd=None, timeout=None, env=None, capture=True):
+    """Run a command without blocking the event loop. Returns (returncode, stdout, stderr).
+
+    With capture=False output goes to /dev/null and stdout/stderr come back empty.
+    """
+    stdio = asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, cwd=cwd, env=env, stdout=stdio, stderr=stdio
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    finally:
+        # On timeout or cancellation, don't leave the child running
+        if proc.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+            await proc.wait()
+    if not capture:
+        return proc.returncode, "", ""
+    return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")